@@ -1,10 +1,18 @@
 import os
+import re
+import sys
 import json
+import shutil
+import hashlib
+import functools
+import contextlib
+import time
 import signal
+import asyncio
 import subprocess
 import platform
 from collections import deque
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from rich.console import Console, Group
 from rich.progress import (
@@ -18,8 +26,17 @@ from rich.panel import Panel
 from rich.table import Table
 from rich.live import Live
 from rich.rule import Rule
+from rich.text import Text
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 VIDEO_EXTS = (".mp4", ".mov", ".mkv", ".avi", ".flv", ".webm")
+VIDEO_EXT_SET = frozenset(e[1:] for e in VIDEO_EXTS)
+OUT_TIME_RE = re.compile(rb"out_time_ms=(\d+)")
+IO_WORKERS = min(32, (os.cpu_count() or 1) * 4)
 
 console = Console()
 
@@ -36,6 +53,19 @@ def handle_sigint(sig, frame):
 signal.signal(signal.SIGINT, handle_sigint)
 
 
+# ================= 日志区域 =================
+class RecentLogs:
+    # 常驻于 Live 中的日志区域：追加时解析一次 markup，刷新时逐行输出，无需拼接字符串
+    def __init__(self, maxlen=5):
+        self.lines = deque(maxlen=maxlen)
+
+    def append(self, msg):
+        self.lines.append(Text.from_markup(msg))
+
+    def __rich_console__(self, console, options):
+        yield from list(self.lines)
+
+
 # ================= 播放提示音 =================
 def play_notification():
     try:
@@ -48,33 +78,270 @@ def play_notification():
         pass
 
 
+# ================= 子进程创建 =================
+# POSIX 下用 posix_spawn 创建子进程，避免父进程内存较大时 fork 复制页表的开销
+USE_POSIX_SPAWN = os.name == "posix" and hasattr(os, "posix_spawnp")
+SPAWN_KWARGS = {"close_fds": False} if USE_POSIX_SPAWN else {}
+
+@functools.lru_cache(maxsize=None)
+def resolve_exe(name):
+    # subprocess 仅在可执行文件为完整路径时才会走 posix_spawn 快速路径
+    if not USE_POSIX_SPAWN:
+        return name
+    return shutil.which(name) or name
+
+
+def spawn_capture(argv):
+    if not USE_POSIX_SPAWN:
+        return subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+
+    r, w = os.pipe()
+    try:
+        pid = os.posix_spawnp(argv[0], argv, os.environ, file_actions=[
+            (os.POSIX_SPAWN_DUP2, w, 1),
+            (os.POSIX_SPAWN_OPEN, 2, os.devnull, os.O_WRONLY, 0),
+        ])
+    except Exception:
+        os.close(r)
+        raise
+    finally:
+        os.close(w)
+
+    with os.fdopen(r, "rb") as f:
+        out = f.read()
+    os.waitpid(pid, 0)
+    return out
+
+
+# ================= JSON 读写 =================
+def load_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def save_json(path, data):
+    tmp = path + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+
 # ================= NVENC 检测 =================
+CAPS_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "videocompressor", "caps.json")
+
+def detect_nvenc():
+    # 逐行读取，一旦看到 hevc_nvenc 立即结束 ffmpeg
+    p = subprocess.Popen(
+        [resolve_exe("ffmpeg"), "-hide_banner", "-encoders"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        **SPAWN_KWARGS,
+    )
+    found = False
+    try:
+        for line in p.stdout:
+            if "hevc_nvenc" in line:
+                found = True
+                break
+    finally:
+        if p.poll() is None:
+            p.terminate()
+        p.stdout.close()
+        p.wait()
+    return found
+
+
 def has_nvenc():
     try:
-        r = subprocess.run(
-            ["ffmpeg", "-hide_banner", "-encoders"],
-            capture_output=True,
-            text=True,
-        )
-        return "hevc_nvenc" in r.stdout
+        exe = shutil.which("ffmpeg")
+        key = None
+        caps = {}
+        if exe:
+            mtime = os.stat(exe).st_mtime_ns
+            key = hashlib.blake2b(f"{exe}:{mtime}".encode("utf-8"), digest_size=16).hexdigest()
+            caps = load_json(CAPS_CACHE_PATH)
+            if key in caps:
+                return caps[key]["hevc_nvenc"]
+
+        found = detect_nvenc()
+        if key:
+            caps[key] = {"hevc_nvenc": found}
+            save_json(CAPS_CACHE_PATH, caps)
+        return found
     except Exception:
         return False
 
 
-# ================= 分辨率 =================
-def get_resolution(path):
+# ================= 并发上限 =================
+NVENC_MAX_SESSIONS = 2
+X265_THREADS_PER_JOB = 6
+
+def available_cpus():
+    # 以进程亲和性为准，taskset / 容器限定核数时与实际可用的 CPU 保持一致
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def encoder_slots(nvenc, workers):
+    # NVENC 约 2 路即饱和；x265 单进程超过 ~6 核后收益递减
+    if nvenc:
+        return min(workers, NVENC_MAX_SESSIONS)
+    return min(workers, max(1, len(available_cpus()) // X265_THREADS_PER_JOB))
+
+
+# ================= CPU 绑定 =================
+TASKSET = shutil.which("taskset") if sys.platform.startswith("linux") else None
+
+def physical_cores(cpus):
+    # 按 thread_siblings_list 把同一物理核上的超线程归为一组；读不到拓扑时每个逻辑 CPU 单独一组
+    cores = {}
+    for c in cpus:
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{c}/topology/thread_siblings_list") as f:
+                key = f.read().strip()
+        except OSError:
+            return [(c,) for c in cpus]
+        cores.setdefault(key, []).append(c)
+    return sorted(tuple(g) for g in cores.values())
+
+
+def partition_cpus(workers):
+    # 以物理核为单位切成 workers 份互不重叠的核组，每个 x265 实例独占整核（含其超线程）
+    cpus = available_cpus()
+    cores = physical_cores(cpus)
+    n = max(1, len(cores) // workers)
+    return [
+        tuple(c for core in cores[i * n:(i + 1) * n] for c in core) or tuple(cpus)
+        for i in range(workers)
+    ]
+
+
+def x265_pool_params(threads):
+    return f"pools={threads}:frame-threads=3"
+
+
+def pin_cmd(cmd, cpus):
+    # 通过 taskset 启动，线程池在 ffmpeg 创建线程之前就已限定在指定核上
+    if not cpus or TASKSET is None:
+        return cmd
+    return [TASKSET, "-c", ",".join(map(str, cpus)), *cmd]
+
+
+@contextlib.asynccontextmanager
+async def encoder_slot(slots):
+    cpus = await slots.get()
+    try:
+        yield cpus
+    finally:
+        slots.put_nowait(cpus)
+
+
+# ================= 视频信息 =================
+def probe(path):
     cmd = [
         "ffprobe", "-v", "error",
         "-select_streams", "v:0",
-        "-show_entries", "stream=width,height",
-        "-of", "json", path
+        "-show_entries", "stream=width,height:format=duration",
+        "-of", "default=nw=1:nk=1", path
     ]
-    info = json.loads(subprocess.run(cmd, capture_output=True, text=True).stdout)
-    s = info["streams"][0]
-    return s["width"], s["height"]
+    # 输出依次为 宽、高、时长 三行
+    w, h, duration = spawn_capture(cmd).split()
+    return int(w), int(h), float(duration)
+
+
+# ================= 探测缓存 =================
+PROBE_CACHE_NAME = ".probe_cache.json"
+
+def load_probe_cache(out_dir):
+    return load_json(os.path.join(out_dir, PROBE_CACHE_NAME))
+
+
+def save_probe_cache(out_dir, cache):
+    save_json(os.path.join(out_dir, PROBE_CACHE_NAME), cache)
+
+
+def cached_probe(path, st, cache):
+    abspath = os.path.abspath(path)
+    key = f"{st.st_size}:{st.st_mtime_ns}"
+    entry = cache.get(abspath)
+    if not entry or entry["key"] != key:
+        w, h, duration = probe(path)
+        entry = {"key": key, "width": w, "height": h, "duration": duration}
+        cache[abspath] = entry
+    if xxhash is not None and "fingerprint" not in entry:
+        entry["fingerprint"] = fingerprint(path, st.st_size)
+    return entry["width"], entry["height"], entry["duration"]
+
+
+# ================= 内容指纹 =================
+FINGERPRINT_CHUNK = 1 << 20
+
+def fingerprint(path, size):
+    # 只读首尾各 1MB，用于识别被移动 / 重命名过的已压缩源文件
+    with open(path, "rb") as f:
+        head = f.read(FINGERPRINT_CHUNK)
+        if size > 2 * FINGERPRINT_CHUNK:
+            f.seek(size - FINGERPRINT_CHUNK)
+        tail = f.read()
+    h = xxhash.xxh3_64(head)
+    h.update(tail)
+    h.update(str(size).encode("ascii"))
+    return h.hexdigest()
+
+
+def outputs_by_fingerprint(cache, existing_outputs):
+    # {内容指纹: 已有输出文件名}，源文件指纹命中即视为已压缩
+    return {
+        e["fingerprint"]: e["output"] for e in cache.values()
+        if e.get("fingerprint") and existing_outputs.get(e.get("output"), 0) > 0
+    }
+
+
+# ================= 单文件探测 =================
+def probe_entry(path, st, cache):
+    # st 为扫描阶段拿到的 stat 结果，这里不再重复 stat
+    try:
+        w, h, duration = cached_probe(path, st, cache)
+        return w, h, duration, st.st_size
+    except Exception:
+        return None
+
+
+# ================= 分段规划 =================
+SEGMENT_MIN_DURATION = 120
+
+def split_candidates(videos, stats, workers):
+    # 文件数少或存在超大文件时才考虑分段；此时尚未探测，以文件体积代替时长
+    if workers < 2 or not videos:
+        return set()
+    if len(videos) < workers * 2:
+        return set(videos)
+    sizes = sorted(stats[v].st_size for v in videos)
+    median = sizes[len(sizes) // 2]
+    return {v for v in videos if stats[v].st_size > 10 * median}
+
+
+def plan_segments(duration, workers):
+    # 按时长均分成 workers 段并行编码，避免单个大文件拖住整批；
+    # 各段都会重新编码且 -ss 放在输入端精确定位，切点无需对齐关键帧，也就不必扫描整个文件
+    if workers < 2 or duration < SEGMENT_MIN_DURATION:
+        return None
+    cuts = [duration * k / workers for k in range(1, workers)]
+    return list(zip([0.0, *cuts], [*cuts, None]))
 
 
 # ================= CRF 策略 =================
+RESOLUTION_BUCKETS = ((3840, 2160), (1920, 1080), (0, 0))
+
 def auto_crf(w, h, nvenc):
     if w >= 3840 or h >= 2160:
         return 19 if nvenc else 24
@@ -83,95 +350,446 @@ def auto_crf(w, h, nvenc):
     return 23 if nvenc else 28
 
 
-# ================= 视频时长 =================
-def get_duration(path):
-    cmd = [
-        "ffprobe", "-v", "error",
-        "-show_entries", "format=duration",
-        "-of", "json", path
-    ]
-    info = json.loads(subprocess.run(cmd, capture_output=True, text=True).stdout)
-    return float(info["format"]["duration"])
+# ================= 编码参数 =================
+def build_vcodec(crf, nvenc, x265_params=None):
+    if nvenc:
+        return ("-c:v", "hevc_nvenc", "-cq", str(crf), "-preset", "p6")
+    vcodec = ("-c:v", "libx265", "-crf", str(crf), "-preset", "slow")
+    if x265_params:
+        vcodec += ("-x265-params", x265_params)
+    return vcodec
+
+
+# ================= 临时文件 =================
+PART_SUFFIX = ".part"
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# ================= 执行 ffmpeg =================
+async def run_ffmpeg(cmd, on_time=None, cpus=None):
+    # on_time 为 None 时不读取进度；返回 False 表示被中断
+    cmd = pin_cmd(cmd, cpus)
+    p = None
+    try:
+        if on_time is None:
+            p = await asyncio.create_subprocess_exec(
+                resolve_exe(cmd[0]), *cmd[1:],
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+                **SPAWN_KWARGS,
+            )
+            while True:
+                try:
+                    await asyncio.wait_for(p.wait(), timeout=0.5)
+                    break
+                except asyncio.TimeoutError:
+                    if stop_requested:
+                        p.terminate()
+                        await p.wait()
+                        return False
+        else:
+            p = await asyncio.create_subprocess_exec(
+                resolve_exe(cmd[0]), *cmd[1:-1],
+                "-progress", "pipe:1", "-nostats",
+                cmd[-1],
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                limit=1 << 20,
+                **SPAWN_KWARGS,
+            )
+
+            tail = b""
+            while True:
+                chunk = await p.stdout.read(65536)
+                if not chunk:
+                    break
+                if stop_requested:
+                    p.terminate()
+                    await p.wait()
+                    return False
+                head, _, tail = (tail + chunk).rpartition(b"\n")
+                m = None
+                for m in OUT_TIME_RE.finditer(head):
+                    pass
+                if m:
+                    on_time(int(m.group(1)) / 1_000_000)
+
+        if await p.wait() != 0:
+            # 终端里的 Ctrl+C 也会发给 ffmpeg，此时按中断处理而不是失败
+            if stop_requested:
+                return False
+            raise RuntimeError(f"ffmpeg 退出码 {p.returncode}")
+        return True
+    except asyncio.CancelledError:
+        if p is not None and p.returncode is None:
+            p.terminate()
+            await p.wait()
+        raise
+
+
+# ================= 进度节流 =================
+UPDATE_INTERVAL = 0.25
+
+def throttled_update(progress, task_id):
+    # 同一任务至少间隔 250ms 或进度跳变 ≥1% 才刷新，减少 Rich 重绘与锁竞争
+    last_ts = 0.0
+    last_pct = 0.0
+
+    def update(pct):
+        nonlocal last_ts, last_pct
+        now = time.monotonic()
+        if now - last_ts < UPDATE_INTERVAL and pct - last_pct < 1:
+            return
+        last_ts, last_pct = now, pct
+        progress.update(task_id, completed=pct)
+
+    return update
 
 
 # ================= 单文件处理 =================
-def compress_one(
-    path, out_dir, existing_outputs,
-    nvenc, crf_override,
-    progress, recent_logs
+def output_name(path):
+    return os.path.splitext(os.path.basename(path))[0] + "_h265.mp4"
+
+
+async def compress_one(
+    path, out_dir, info, segs,
+    nvenc, crf_override, vcodecs,
+    progress, recent_logs, slots, estimates=None
 ):
-    global stop_requested
     if stop_requested:
         return None
 
     name = os.path.basename(path)
-    base = os.path.splitext(name)[0]
-    out_name = base + "_h265.mp4"
-    out_path = os.path.join(out_dir, out_name)
+    out_path = os.path.join(out_dir, output_name(path))
 
-    if out_name in existing_outputs:
-        recent_logs.append(f"[grey58]⏭ 跳过已存在文件：{name}[/grey58]")
-        return "skipped", 0, 0
+    if info is None:
+        recent_logs.append(f"[red]❌ 失败：{name} (无法读取视频信息)[/red]")
+        return None
 
-    src_size = os.path.getsize(path)
-    w, h = get_resolution(path)
+    w, h, duration, src_size = info
     crf = crf_override if crf_override is not None else auto_crf(w, h, nvenc)
-    duration = get_duration(path)
-
-    task_id = progress.add_task(f"🎞 [cyan]正在压缩:[/cyan] {name}", total=100)
+    vcodec = vcodecs[crf]
 
-    if nvenc:
-        vcodec = ["-c:v", "hevc_nvenc", "-cq", str(crf), "-preset", "p6"]
-    else:
-        vcodec = ["-c:v", "libx265", "-crf", str(crf), "-preset", "slow"]
+    if segs:
+        return await compress_split(
+            path, out_dir, out_path, vcodec, duration, src_size,
+            segs, progress, recent_logs, slots
+        )
 
+    # 先写入 .part，成功后再原子改名，中断或崩溃不会留下半成品
+    tmp_path = out_path + PART_SUFFIX
     cmd = [
         "ffmpeg", "-y",
         "-i", path,
         *vcodec,
         "-pix_fmt", "yuv420p",
         "-c:a", "copy",
-        "-progress", "pipe:1",
-        "-nostats",
-        out_path
+        "-f", "mp4",
+        tmp_path
     ]
 
-    try:
-        p = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.DEVNULL,
-            text=True,
-        )
+    async with encoder_slot(slots) as cpus:
+        if stop_requested:
+            return None
+
+        task_id = progress.add_task(f"🎞 [cyan]正在压缩:[/cyan] {name}", total=100)
+        try:
+            if estimates is not None:
+                estimates[task_id] = (time.monotonic(), duration)
+                ok = await run_ffmpeg(cmd, cpus=cpus)
+            else:
+                update = throttled_update(progress, task_id)
+                ok = await run_ffmpeg(
+                    cmd, lambda t: update(min(t / duration * 100, 100)), cpus
+                )
+            if not ok:
+                return None
 
-        for line in p.stdout:
+            os.replace(tmp_path, out_path)
+            recent_logs.append(f"[green]✅ 已完成：{name}[/green]")
+            dst_size = os.path.getsize(out_path)
+            return "done", src_size, dst_size, path
+        except Exception as e:
+            recent_logs.append(f"[red]❌ 失败：{name} ({str(e)})[/red]")
+            return None
+        finally:
+            if estimates is not None:
+                estimates.pop(task_id, None)
+            progress.remove_task(task_id)
+            remove_quietly(tmp_path)
+
+
+# ================= 分段处理 =================
+async def compress_split(
+    path, out_dir, out_path, vcodec, duration, src_size,
+    segments, progress, recent_logs, slots
+):
+    # 各段只编码视频，合并时再从源文件复制音频，避免段边界处音频断裂
+    name = os.path.basename(path)
+    seg_dir = os.path.abspath(
+        os.path.join(out_dir, ".segments", os.path.splitext(name)[0])
+    )
+    seg_paths = [os.path.join(seg_dir, f"{i:03d}.mp4") for i in range(len(segments))]
+    tmp_path = out_path + PART_SUFFIX
+    seg_times = [0.0] * len(segments)
+
+    task_id = progress.add_task(
+        f"🎞 [cyan]正在压缩:[/cyan] {name} [grey58]({len(segments)} 段)[/grey58]",
+        total=100
+    )
+
+    update = throttled_update(progress, task_id)
+
+    def report(i, t):
+        seg_times[i] = t
+        update(min(sum(seg_times) / duration * 100, 100))
+
+    async def encode_segment(i, start, end):
+        cmd = ["ffmpeg", "-y", "-ss", f"{start:.6f}", "-i", path]
+        if end is not None:
+            cmd += ["-t", f"{end - start:.6f}"]
+        cmd += [*vcodec, "-pix_fmt", "yuv420p", "-an", seg_paths[i]]
+        async with encoder_slot(slots) as cpus:
             if stop_requested:
-                p.terminate()
-                return None
-            if line.startswith("out_time_ms="):
-                t = int(line.split("=")[1]) / 1_000_000
-                progress.update(task_id, completed=min(t / duration * 100, 100))
+                return False
+            return await run_ffmpeg(cmd, lambda t: report(i, t), cpus)
 
-        p.wait()
+    try:
+        os.makedirs(seg_dir, exist_ok=True)
+        seg_tasks = [
+            asyncio.create_task(encode_segment(i, s, e))
+            for i, (s, e) in enumerate(segments)
+        ]
+        try:
+            for f in asyncio.as_completed(seg_tasks):
+                if not await f:
+                    return None
+        finally:
+            # 任一段失败或被中断时，先取消并等待其余段结束，再清理分段目录
+            for t in seg_tasks:
+                t.cancel()
+            await asyncio.gather(*seg_tasks, return_exceptions=True)
+
+        list_path = os.path.join(seg_dir, "list.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for sp in seg_paths:
+                f.write("file '" + sp.replace("'", "'\\''") + "'\n")
+
+        ok = await run_ffmpeg([
+            "ffmpeg", "-y",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-i", path,
+            # 与不分段时 ffmpeg 默认选流一致，只保留一条音轨
+            "-map", "0:v", "-map", "1:a:0?",
+            "-c", "copy",
+            "-f", "mp4",
+            tmp_path
+        ])
+        if not ok:
+            return None
+
+        os.replace(tmp_path, out_path)
         recent_logs.append(f"[green]✅ 已完成：{name}[/green]")
         dst_size = os.path.getsize(out_path)
-        return "done", src_size, dst_size
+        return "done", src_size, dst_size, path
     except Exception as e:
         recent_logs.append(f"[red]❌ 失败：{name} ({str(e)})[/red]")
         return None
     finally:
         progress.remove_task(task_id)
+        remove_quietly(tmp_path)
+        shutil.rmtree(seg_dir, ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(seg_dir))
+        except OSError:
+            pass
+
+
+# ================= 估算进度 =================
+async def tick_estimates(progress, estimates):
+    # 多路并发时不再读取 ffmpeg 进度，按已用时间 / 视频时长估算
+    while True:
+        await asyncio.sleep(0.5)
+        now = time.monotonic()
+        for task_id, (start, duration) in list(estimates.items()):
+            ratio = (now - start) / duration if duration > 0 else 0
+            progress.update(task_id, completed=min(ratio, 0.99) * 100)
+
+
+# ================= 批量调度 =================
+PREFETCH_MAX = 8
+
+async def run_batch(
+    videos, stats, out_dir, existing_outputs, probe_cache, candidates,
+    nvenc, crf_override, workers,
+    progress, total_task, recent_logs
+):
+    # 每个槽位对应一个并发编码名额；多路 x265 时槽位还携带独占的 CPU 核组
+    slots = asyncio.Queue()
+    x265_params = None
+    if not nvenc and workers > 1:
+        cpu_sets = partition_cpus(workers)
+        x265_params = x265_pool_params(len(cpu_sets[0]))
+    else:
+        cpu_sets = [None] * workers
+    for cpus in cpu_sets:
+        slots.put_nowait(cpus)
+    # 每个分辨率档位的 CRF 只生成一次编码参数，各任务共享同一个不可变元组
+    if crf_override is not None:
+        crfs = {crf_override}
+    else:
+        crfs = {auto_crf(w, h, nvenc) for w, h in RESOLUTION_BUCKETS}
+    vcodecs = {crf: build_vcodec(crf, nvenc, x265_params) for crf in crfs}
+    estimates = {} if workers > 2 else None
+    ticker = None
+    if estimates is not None:
+        ticker = asyncio.create_task(tick_estimates(progress, estimates))
+
+    done_by_fp = outputs_by_fingerprint(probe_cache, existing_outputs) if xxhash else {}
+    # 探测只领先编码有限的几个文件（在途探测与已入队的合计）：既能掩盖 ffprobe 延迟，
+    # 中途退出时也不会白白探测整个目录；名额在发起探测时占用，消费者取走后归还
+    ahead = asyncio.Semaphore(min(workers * 2, PREFETCH_MAX))
+    queue = asyncio.Queue()
+
+    total_src = total_dst = 0
+    encoded = []
+
+    def finish(r=None):
+        nonlocal total_src, total_dst
+        # 中断后才编码完成的文件同样计入统计与记录，只是不再推进总进度
+        if r and r[0] == "done":
+            total_src += r[1]
+            total_dst += r[2]
+            encoded.append(r[3])
+        if stop_requested:
+            return
+
+        progress.advance(total_task)
+
+        done = int(progress.tasks[total_task].completed)
+        progress.update(
+            total_task,
+            description=f"[bold cyan]📦 总进度 ({done}/{len(videos)})"
+        )
+
+    def prepare(v):
+        # 在线程中完成探测、指纹比对与分段规划；命中已压缩指纹时返回对应输出名
+        info = probe_entry(v, stats[v], probe_cache)
+        fp = probe_cache.get(os.path.abspath(v), {}).get("fingerprint")
+        if fp and fp in done_by_fp:
+            return info, done_by_fp[fp], None
+        segs = None
+        if info and v in candidates:
+            segs = plan_segments(info[2], workers)
+        return info, None, segs
+
+    async def produce():
+        # 按 LPT 顺序发起探测，谁先完成谁先入队，个别文件探测缓慢时不会拖住后面的文件
+        moved = 0
+        probes = []
+
+        async def probe_one(v):
+            nonlocal moved
+            info, output, segs = await asyncio.to_thread(prepare, v)
+            if stop_requested:
+                ahead.release()
+                return
+            if output:
+                probe_cache[os.path.abspath(v)]["output"] = output
+                moved += 1
+                finish()
+                ahead.release()
+                return
+            queue.put_nowait((v, info, segs))
+
+        try:
+            for v in videos:
+                await ahead.acquire()
+                if stop_requested:
+                    break
+                probes.append(asyncio.create_task(probe_one(v)))
+            await asyncio.gather(*probes)
+        finally:
+            for t in probes:
+                t.cancel()
+
+        if moved:
+            recent_logs.append(
+                f"[grey58]⏭ 已跳过 {moved} 个内容相同的已压缩文件（移动或重命名）[/grey58]"
+            )
+        queue.put_nowait(None)
+
+    async def consume():
+        while True:
+            item = await queue.get()
+            if item is None:
+                # 把结束标记留给其他消费者
+                queue.put_nowait(None)
+                return
+            ahead.release()
+            if stop_requested:
+                continue
+
+            v, info, segs = item
+            r = await compress_one(
+                v, out_dir, info, segs,
+                nvenc, crf_override, vcodecs, progress, recent_logs, slots, estimates
+            )
+            finish(r)
+
+    tasks = [asyncio.create_task(produce())]
+    tasks += [asyncio.create_task(consume()) for _ in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for t in tasks:
+            t.cancel()
+        if ticker is not None:
+            ticker.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return total_src, total_dst, encoded
 
 
 # ================= 扫描视频 =================
+def scan_dir(path):
+    subdirs = []
+    vids = []
+    try:
+        with os.scandir(path) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    if e.name != "output_wm":
+                        subdirs.append(e.path)
+                else:
+                    _, dot, ext = e.name.rpartition(".")
+                    if dot and ext.lower() in VIDEO_EXT_SET:
+                        try:
+                            vids.append((e.path, e.stat()))
+                        except OSError:
+                            pass
+    except OSError:
+        pass
+    return subdirs, vids
+
+
 def scan_videos(root):
+    # 返回 [(路径, stat 结果)]，后续的探测缓存与体积统计直接复用
+    # 各目录在线程池中并发读取，NAS 等高延迟文件系统上可同时挂起多个目录读取 / stat 请求
     vids = []
-    for base, dirs, files in os.walk(root):
-        if "output_wm" in dirs:
-            dirs.remove("output_wm")
-        for f in files:
-            if f.lower().endswith(VIDEO_EXTS):
-                vids.append(os.path.join(base, f))
+    with ThreadPoolExecutor(max_workers=IO_WORKERS) as pool:
+        pending = {pool.submit(scan_dir, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                subdirs, found = f.result()
+                vids.extend(found)
+                pending.update(pool.submit(scan_dir, d) for d in subdirs)
     return vids
 
 
@@ -180,7 +798,7 @@ def main():
     while True:
         global stop_requested
         stop_requested = False
-        recent_logs = deque(maxlen=5)
+        recent_logs = RecentLogs(maxlen=5)
 
         console.print(Panel(
             "[bold cyan]🎬 H.265 视频批量压缩工具（专业版）[/bold cyan]\n\n"
@@ -234,17 +852,47 @@ def main():
         out_dir = os.path.join(input_dir, "output_wm")
         os.makedirs(out_dir, exist_ok=True)
 
-        existing_outputs = {
-            f for f in os.listdir(out_dir)
-            if f.lower().endswith("_h265.mp4")
-        }
+        # 记录文件大小，0 字节的残留输出视为未完成；顺带清理上次中断留下的 .part 与分段目录
+        shutil.rmtree(os.path.join(out_dir, ".segments"), ignore_errors=True)
+        existing_outputs = {}
+        with os.scandir(out_dir) as it:
+            for e in it:
+                if e.name.endswith(PART_SUFFIX):
+                    remove_quietly(e.path)
+                elif e.name.lower().endswith("_h265.mp4"):
+                    existing_outputs[e.name] = e.stat().st_size
+        probe_cache = load_probe_cache(out_dir)
 
         nvenc = has_nvenc()
-        videos = scan_videos(input_dir)
+        slots = encoder_slots(nvenc, workers)
+        if slots < workers:
+            console.print(
+                f"[yellow]⚠ {'NVENC' if nvenc else 'x265'} 并发上限为 {slots}，"
+                f"线程数已调整为 {slots}[/yellow]"
+            )
+            workers = slots
+
+        stats = dict(scan_videos(input_dir))
+        videos = list(stats)
         if not videos:
             console.print("[bold red]❌ 未找到视频文件[/bold red]")
             continue
 
+        # 已压缩的文件直接剔除，不再为其创建任务，总进度也只统计实际要处理的文件
+        pending = [
+            v for v in videos
+            if existing_outputs.get(output_name(v), 0) == 0
+        ]
+        skipped = len(videos) - len(pending)
+        videos = pending
+        if skipped:
+            recent_logs.append(f"[grey58]⏭ 已跳过 {skipped} 个已压缩文件[/grey58]")
+
+        candidates = split_candidates(videos, stats, workers)
+
+        # 按文件体积从大到小排序（LPT），避免大文件最后才开始导致尾部空等
+        videos.sort(key=lambda v: stats[v].st_size, reverse=True)
+
         progress = Progress(
             TextColumn("{task.description}", justify="left"),
             BarColumn(bar_width=28),
@@ -258,38 +906,20 @@ def main():
             total=len(videos)
         )
 
-        def make_layout():
-            return Group(progress, Rule(style="grey15"), "\n".join(recent_logs))
-
-        total_src = total_dst = 0
-
-        with Live(make_layout(), console=console, refresh_per_second=10):
-            with ThreadPoolExecutor(max_workers=workers) as pool:
-                futures = [
-                    pool.submit(
-                        compress_one, v, out_dir, existing_outputs,
-                        nvenc, crf_override, progress, recent_logs
-                    )
-                    for v in videos
-                ]
-
-                for f in as_completed(futures):
-                    if stop_requested:
-                        break
-
-                    r = f.result()
-
-                    progress.advance(total_task)
+        layout = Group(progress, Rule(style="grey15"), recent_logs)
 
-                    done = int(progress.tasks[total_task].completed)
-                    progress.update(
-                        total_task,
-                        description=f"[bold cyan]📦 总进度 ({done}/{len(videos)})"
-                    )
+        with Live(layout, console=console, refresh_per_second=4, auto_refresh=True):
+            total_src, total_dst, encoded = asyncio.run(run_batch(
+                videos, stats, out_dir, existing_outputs, probe_cache, candidates,
+                nvenc, crf_override, workers,
+                progress, total_task, recent_logs
+            ))
 
-                    if r and r[0] == "done":
-                        total_src += r[1]
-                        total_dst += r[2]
+        for v in encoded:
+            entry = probe_cache.get(os.path.abspath(v))
+            if entry:
+                entry["output"] = output_name(v)
+        save_probe_cache(out_dir, probe_cache)
 
         if total_src > 0:
             table = Table(title="📊 压缩统计")